@@ -1,19 +1,63 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Float
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Float, event, func, select, text
 from sqlalchemy.orm import sessionmaker, scoped_session, relationship, declarative_base
-import plotly.express as px
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import plotly.graph_objects as go
 import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # -------------------------------
 # Database Setup
 # -------------------------------
 Base = declarative_base()
 DB_FILE = "orthotracker.db"
-engine = create_engine(f"sqlite:///{DB_FILE}", echo=False, connect_args={"check_same_thread": False})
-# expire_on_commit=False prevents objects from being expired which helps with Streamlit re-runs
-SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+DASHBOARD_TABLE_LIMIT = 1000  # newest reports shown in the Dashboard table; the CSV has them all
+
+@st.cache_resource
+def get_engine():
+    """
+    Streamlit re-executes this script on every interaction, so the engine (and its
+    connection pool) is cached for the lifetime of the process instead of rebuilt per rerun.
+    """
+    engine = create_engine(
+        f"sqlite:///{DB_FILE}",
+        echo=False,
+        # keep connections (and SQLite's per-connection page cache) open across reruns;
+        # older SQLAlchemy releases default file databases to NullPool
+        poolclass=QueuePool,
+        pool_size=5,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        """
+        WAL lets the dashboards read while a report is being written, and synchronous=NORMAL
+        only fsyncs at checkpoints (still safe under WAL). The rest keeps hot pages in memory.
+        """
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.close()
+
+    return engine
+
+engine = get_engine()
+
+@st.cache_resource
+def get_session_factory():
+    # expire_on_commit=False prevents objects from being expired which helps with Streamlit re-runs
+    return scoped_session(sessionmaker(bind=get_engine(), expire_on_commit=False))
+
+SessionLocal = get_session_factory()
 
 # -------------------------------
 # Models
@@ -37,7 +81,7 @@ class Report(Base):
     procedure_id = Column(Integer, ForeignKey('procedures.id'))
     cases_done = Column(Integer)
     income_generated = Column(Float)
-    reported_at = Column(DateTime, default=datetime.utcnow)
+    reported_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     rep = relationship("Representative", back_populates="reports")
     procedure = relationship("Procedure")  # backref not required here
@@ -50,8 +94,47 @@ class Attachment(Base):
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     procedure = relationship("Procedure", back_populates="attachments")
 
-# Create tables
-Base.metadata.create_all(engine)
+class MonthlyIncome(Base):
+    """
+    Per-month rollup of reports, kept current by the triggers below so the monthly
+    charts read one row per month instead of aggregating every report.
+    """
+    __tablename__ = "monthly_income"
+    month = Column(String, primary_key=True)  # 'YYYY-MM-01'
+    income = Column(Float, nullable=False, default=0.0)
+    cases = Column(Integer, nullable=False, default=0)
+    reports = Column(Integer, nullable=False, default=0)  # row is dropped when this reaches 0
+
+_MONTH_OF = "strftime('%Y-%m-01', {row}.reported_at)"
+_ROLLUP_ADD = """
+    INSERT INTO monthly_income (month, income, cases, reports)
+    SELECT {month}, COALESCE(NEW.income_generated, 0), COALESCE(NEW.cases_done, 0), 1
+    WHERE NEW.reported_at IS NOT NULL
+    ON CONFLICT(month) DO UPDATE SET
+        income = income + excluded.income, cases = cases + excluded.cases, reports = reports + 1;
+""".format(month=_MONTH_OF.format(row="NEW"))
+_ROLLUP_REMOVE = """
+    UPDATE monthly_income SET
+        income = income - COALESCE(OLD.income_generated, 0),
+        cases = cases - COALESCE(OLD.cases_done, 0),
+        reports = reports - 1
+    WHERE month = {month};
+    DELETE FROM monthly_income WHERE month = {month} AND reports <= 0;
+""".format(month=_MONTH_OF.format(row="OLD"))
+MONTHLY_INCOME_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS trg_reports_rollup_insert AFTER INSERT ON reports BEGIN {_ROLLUP_ADD} END",
+    f"CREATE TRIGGER IF NOT EXISTS trg_reports_rollup_delete AFTER DELETE ON reports BEGIN {_ROLLUP_REMOVE} END",
+    "CREATE TRIGGER IF NOT EXISTS trg_reports_rollup_update"
+    " AFTER UPDATE OF reported_at, income_generated, cases_done ON reports"
+    f" BEGIN {_ROLLUP_REMOVE} {_ROLLUP_ADD} END",
+]
+MONTHLY_INCOME_REBUILD = """
+    INSERT INTO monthly_income (month, income, cases, reports)
+    SELECT {month}, SUM(COALESCE(r.income_generated, 0)), SUM(COALESCE(r.cases_done, 0)), COUNT(*)
+    FROM reports AS r
+    WHERE r.reported_at IS NOT NULL
+    GROUP BY 1
+""".format(month=_MONTH_OF.format(row="r"))
 
 # -------------------------------
 # Utility Functions
@@ -59,37 +142,169 @@ Base.metadata.create_all(engine)
 def get_session():
     return SessionLocal()
 
-@st.cache_data(show_spinner=False)
-def _fetch_reports_serialized():
+@st.cache_resource
+def _io_pool():
+    """Worker threads for attachment writes, so disk I/O overlaps the report's DB work."""
+    return ThreadPoolExecutor(max_workers=2)
+
+def _write_attachment(save_path, data):
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, "wb") as f:
+        f.write(data)
+
+def reports_version():
     """
-    Internal cached fetch. Cache will be invalidated by calling function with a key change.
-    We serialize to a plain list-of-dicts so caching is safe.
+    Cheap change token for the reports table: (latest id, latest reported_at).
+    Cached report queries take it as their first argument, so st.cache_data
+    serves them until a report is added and then refetches exactly once.
+    They keep max_entries=1: an older version is never asked for again, so its
+    entry is evicted instead of piling up with every submit.
+    Each MAX() is its own subquery so SQLite answers it with one index/rowid seek;
+    combined with COUNT() in a single SELECT it would scan the whole index instead.
+    Reports are never deleted, so a new row always moves max(id).
     """
     db = get_session()
     try:
-        reports = db.query(Report).all()
-        data = [{
-            "rep": r.rep.name if r.rep else "Unknown",
-            "procedure": r.procedure.name if r.procedure else "Unknown",
-            "cases": r.cases_done or 0,
-            "income": r.income_generated or 0.0,
-            "date": r.reported_at
-        } for r in reports]
-        return data
+        latest_id, latest = db.query(
+            select(func.max(Report.id)).scalar_subquery(),
+            select(func.max(Report.reported_at)).scalar_subquery(),
+        ).one()
+        return latest_id, latest
     finally:
         db.close()
 
-def get_all_reports(force_refresh: bool = False):
+@st.cache_data(show_spinner=False, max_entries=1)
+def report_count(version):
+    """Number of reports; counted once per data version rather than on every rerun."""
+    db = get_session()
+    try:
+        return db.query(func.count(Report.id)).scalar()
+    finally:
+        db.close()
+
+def _reports_select():
+    """Report rows with rep/procedure names joined in; NULLs become Unknown/0."""
+    return (
+        select(
+            func.coalesce(Representative.name, "Unknown").label("rep"),
+            func.coalesce(Procedure.name, "Unknown").label("procedure"),
+            func.coalesce(Report.cases_done, 0).label("cases"),
+            func.coalesce(Report.income_generated, 0.0).label("income"),
+            Report.reported_at.label("date"),
+        )
+        .select_from(Report)
+        .outerjoin(Representative, Report.rep_id == Representative.id)
+        .outerjoin(Procedure, Report.procedure_id == Procedure.id)
+    )
+
+def _read_reports(stmt):
+    # cases is COALESCEd so never NULL; int32 halves it. income stays float64 so KSh totals stay exact.
+    df = pd.read_sql_query(stmt, engine, parse_dates=["date"], dtype={"cases": "int32"})
+    # a handful of distinct names repeated on every row: store them as category codes
+    for col in ("rep", "procedure"):
+        df[col] = df[col].astype("category")
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _fetch_reports_df(version):
+    """
+    Internal cached fetch, keyed on reports_version().
+    Rep/procedure names are joined in SQL and rows go straight into a DataFrame,
+    so no ORM objects (or per-row dicts) are built.
+    """
+    return _read_reports(_reports_select())
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def recent_reports(version, limit=DASHBOARD_TABLE_LIMIT):
+    """
+    Latest `limit` reports, newest first, for the dashboard table.
+    SQLite sorts on the indexed reported_at and stops at the limit, so no full-frame sort in pandas.
+    """
+    return _read_reports(_reports_select().order_by(Report.reported_at.desc()).limit(limit))
+
+def get_all_reports(version=None):
     """
     Returns a dataframe of all reports.
-    If force_refresh=True, we include a varying param to invalidate cached _fetch_reports_serialized() call.
+    Pass a reports_version() token if the caller already has one; otherwise it is looked up.
     """
-    # trick: include timestamp as cache key by calling the cached function directly (st.cache_data handles it)
-    data = _fetch_reports_serialized()
-    df = pd.DataFrame(data)
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["date"])
-    return df
+    if version is None:
+        version = reports_version()
+    return _fetch_reports_df(version)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def reports_csv(version):
+    """All reports as UTF-8 CSV bytes, encoded once per data version rather than on every rerun."""
+    buf = io.BytesIO()
+    get_all_reports(version).to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_reps():
+    """(id, name) pairs for the Add Data selectbox. Cleared whenever a representative is added."""
+    db = get_session()
+    try:
+        return [tuple(r) for r in db.query(Representative.id, Representative.name).order_by(Representative.name).all()]
+    finally:
+        db.close()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_procedures():
+    """(id, name) pairs for the Add Data selectbox. Cleared whenever a procedure is added."""
+    db = get_session()
+    try:
+        return [tuple(p) for p in db.query(Procedure.id, Procedure.name).order_by(Procedure.name).all()]
+    finally:
+        db.close()
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def get_report_totals(version):
+    """
+    Returns (total_cases, total_income) across all reports.
+    Aggregated in SQL so the result is a single row regardless of table size.
+    """
+    db = get_session()
+    try:
+        total_cases, total_income = db.query(
+            func.coalesce(func.sum(Report.cases_done), 0),
+            func.coalesce(func.sum(Report.income_generated), 0.0),
+        ).one()
+        return int(total_cases), float(total_income)
+    finally:
+        db.close()
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def cases_by_rep(version):
+    """Total cases per representative (ordered by name), summed in SQL so one row per rep is returned."""
+    rep = func.coalesce(Representative.name, "Unknown").label("rep")
+    stmt = (
+        select(rep, func.coalesce(func.sum(Report.cases_done), 0).label("cases"))
+        .select_from(Report)
+        .outerjoin(Representative, Report.rep_id == Representative.id)
+        .group_by(rep)
+        .order_by(rep)
+    )
+    return pd.read_sql_query(stmt, engine)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def income_by_month(version):
+    """Total income per calendar month (dated to the 1st), read from the trigger-maintained rollup."""
+    stmt = select(MonthlyIncome.month.label("date"), MonthlyIncome.income).order_by(MonthlyIncome.month)
+    return pd.read_sql_query(stmt, engine, parse_dates=["date"])
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def income_by_procedure(version, limit: int = 10):
+    """Top procedures by total income, summed in SQL so only one row per procedure is returned."""
+    procedure = func.coalesce(Procedure.name, "Unknown").label("procedure")
+    income = func.coalesce(func.sum(Report.income_generated), 0.0).label("income")
+    stmt = (
+        select(procedure, income)
+        .select_from(Report)
+        .outerjoin(Procedure, Report.procedure_id == Procedure.id)
+        .group_by(procedure)
+        .order_by(income.desc())
+        .limit(limit)
+    )
+    return pd.read_sql_query(stmt, engine)
 
 def seed_defaults():
     """Helper to create initial reps/procedures if none exist."""
@@ -105,6 +320,232 @@ def seed_defaults():
     finally:
         db.close()
 
+@st.cache_resource
+def init_db():
+    """
+    Create tables and seed defaults. Cached so it runs once per process; otherwise every
+    rerun would re-issue the schema checks and the seed COUNT(*) queries.
+    """
+    Base.metadata.create_all(engine)
+    # create_all() skips indexes on tables that already exist, so add new ones to older databases
+    for index in Report.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for ddl in MONTHLY_INCOME_TRIGGERS:
+            conn.execute(text(ddl))
+        # rebuild the rollup from reports, so databases that predate the triggers are covered too
+        conn.execute(text("DELETE FROM monthly_income"))
+        conn.execute(text(MONTHLY_INCOME_REBUILD))
+    seed_defaults()  # ensure there is at least some data to start with
+    return True
+
+init_db()
+
+# -------------------------------
+# Charts
+# -------------------------------
+# Figures are built fresh from the (cached) aggregate frames on each rerun: they're a
+# handful of rows, and unpickling a cached Figure re-runs plotly's validation, which costs
+# more than building it. graph_objects is fed the columns as arrays directly, skipping
+# plotly express's DataFrame copy and type inference.
+def build_cases_fig(rep_cases):
+    fig = go.Figure(go.Bar(
+        x=rep_cases["rep"].to_numpy(),
+        y=rep_cases["cases"].to_numpy(),
+        marker=dict(color=rep_cases["cases"].to_numpy(), colorscale="Viridis", showscale=True, colorbar=dict(title="cases")),
+    ))
+    fig.update_layout(title="Total Cases by Representative", xaxis_title="rep", yaxis_title="cases")
+    return fig
+
+def build_income_fig(income_time, title):
+    fig = go.Figure(go.Scatter(
+        x=income_time["date"].to_numpy(),
+        y=income_time["income"].to_numpy(),
+        mode="lines+markers",
+        line=dict(shape="spline"),
+    ))
+    fig.update_layout(title=title, xaxis_title="date", yaxis_title="income")
+    return fig
+
+def build_pie_fig(data, names, values, title):
+    fig = go.Figure(go.Pie(labels=data[names].to_numpy(), values=data[values].to_numpy()))
+    fig.update_layout(title=title)
+    return fig
+
+# -------------------------------
+# Views
+# -------------------------------
+@st.fragment
+def add_data_view():
+    """
+    Add Data form. Runs as a fragment: typing into its widgets reruns only this
+    function, not the whole app (and none of the dashboard queries).
+    """
+    st.subheader("➕ Add New Report / Entities")
+    reps = list_reps()
+    procs = list_procedures()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if reps:
+            rep_choice = st.selectbox("Representative", reps, format_func=lambda r: r[1])
+        else:
+            rep_choice = None
+            st.warning("No representatives found. Add one below.")
+
+        new_rep = st.text_input("Or add new Representative (type a name and press +)", key="new_rep")
+        if st.button("➕ Add Representative"):
+            if new_rep.strip():
+                db = get_session()
+                try:
+                    # one INSERT ... ON CONFLICT(name) DO NOTHING instead of SELECT-then-INSERT; UNIQUE(name) decides
+                    stmt = sqlite_insert(Representative).values(name=new_rep.strip()).on_conflict_do_nothing(index_elements=["name"])
+                    result = db.execute(stmt)
+                    db.commit()
+                    if result.rowcount == 0:
+                        st.warning("Representative already exists.")
+                    else:
+                        list_reps.clear()
+                        st.success("Representative added.")
+                        st.rerun()
+                except Exception as e:
+                    db.rollback()
+                    st.error("Failed to add representative.")
+                    st.error(str(e))
+                finally:
+                    db.close()
+
+    with col2:
+        if procs:
+            proc_choice = st.selectbox("Procedure", procs, format_func=lambda p: p[1])
+        else:
+            proc_choice = None
+            st.warning("No procedures found. Add one below.")
+
+        new_proc = st.text_input("Or add new Procedure (type a name and press +)", key="new_proc")
+        if st.button("➕ Add Procedure"):
+            if new_proc.strip():
+                db = get_session()
+                try:
+                    # one INSERT ... ON CONFLICT(name) DO NOTHING instead of SELECT-then-INSERT; UNIQUE(name) decides
+                    stmt = sqlite_insert(Procedure).values(name=new_proc.strip()).on_conflict_do_nothing(index_elements=["name"])
+                    result = db.execute(stmt)
+                    db.commit()
+                    if result.rowcount == 0:
+                        st.warning("Procedure already exists.")
+                    else:
+                        list_procedures.clear()
+                        st.success("Procedure added.")
+                        st.rerun()
+                except Exception as e:
+                    db.rollback()
+                    st.error("Failed to add procedure.")
+                    st.error(str(e))
+                finally:
+                    db.close()
+
+    st.markdown("---")
+    st.write("Add a report (choose existing rep/procedure or add new ones above).")
+    # fallback: if no existing reps/procs, require manual name
+    rep_name_final = rep_choice[1] if rep_choice else st.text_input("Representative name (required if none above)")
+    proc_name_final = proc_choice[1] if proc_choice else st.text_input("Procedure name (required if none above)")
+
+    cases = st.number_input("Cases Done", min_value=0, step=1, value=0)
+    income = st.number_input("Income Generated (KSh)", min_value=0.0, step=100.0, value=0.0)
+    report_date = st.date_input("Reported Date", value=datetime.utcnow().date())
+    uploaded_file = st.file_uploader("Attach file (optional)", type=["pdf", "png", "jpg", "jpeg"])
+
+    if st.button("Submit Report"):
+        if not rep_name_final or not proc_name_final:
+            st.error("Representative and Procedure are required.")
+        else:
+            # start writing the attachment to disk now; it runs while the DB work below happens
+            write_future = None
+            if uploaded_file is not None:
+                # store file on disk (simple approach) - consider storing in object storage for production
+                save_path = f"uploads/{uploaded_file.name}"
+                # written under a temporary name and only moved into place once the report commits,
+                # so a failed save neither leaves a stray file nor overwrites an existing attachment
+                tmp_path = f"{save_path}.{uuid.uuid4().hex}.part"
+                write_future = _io_pool().submit(_write_attachment, tmp_path, uploaded_file.getbuffer())
+
+            db = get_session()
+            try:
+                # a selected rep already carries its id; a typed name is looked up (id only) or created
+                if rep_choice:
+                    rep_id = rep_choice[0]
+                else:
+                    rep_id = db.query(Representative.id).filter_by(name=rep_name_final.strip()).scalar()
+                if rep_id is None:
+                    rep = Representative(name=rep_name_final.strip())
+                    db.add(rep)
+                    db.flush()  # assign id
+                    rep_id = rep.id
+
+                if proc_choice:
+                    proc_id = proc_choice[0]
+                else:
+                    proc_id = db.query(Procedure.id).filter_by(name=proc_name_final.strip()).scalar()
+                if proc_id is None:
+                    proc = Procedure(name=proc_name_final.strip())
+                    db.add(proc)
+                    db.flush()
+                    proc_id = proc.id
+
+                dt = datetime.combine(report_date, datetime.utcnow().time())
+                new_report = Report(rep_id=rep_id, procedure_id=proc_id, cases_done=int(cases), income_generated=float(income), reported_at=dt)
+                db.add(new_report)
+
+                # handle attachment (same transaction as the report, so one commit covers both)
+                if write_future is not None:
+                    att = Attachment(procedure_id=proc_id, filename=save_path)
+                    db.add(att)
+                    db.flush()
+                    write_future.result()  # re-raises a failed write so the report is rolled back
+
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                st.error("Failed to save report.")
+                st.error(str(e))
+                if write_future is not None:
+                    # wait for the write so its error isn't lost and the temp file can be removed
+                    write_error = write_future.exception()
+                    if write_error is not None and write_error is not e:
+                        st.error(f"Attachment could not be written: {write_error}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                return
+            finally:
+                db.close()
+
+            # the report is committed from here on; only the attachment file can still fail
+            st.success("✅ Report added successfully!")
+            attachment_stored = True
+            if write_future is not None:
+                try:
+                    os.replace(tmp_path, save_path)
+                except OSError as e:
+                    attachment_stored = False
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    # drop the row so it doesn't point at a file that was never stored
+                    db = get_session()
+                    try:
+                        db.query(Attachment).filter_by(id=att.id).delete()
+                        db.commit()
+                    finally:
+                        db.close()
+                    st.error(f"The attachment could not be stored: {e}")
+
+            # cached report queries pick the new row up via reports_version();
+            # clear the lookups in case a new rep/procedure was created
+            list_reps.clear()
+            list_procedures.clear()
+            if attachment_stored:
+                st.rerun()  # otherwise stay put so the attachment error remains visible
+
+
 # -------------------------------
 # Main App
 # -------------------------------
@@ -112,80 +553,67 @@ def main():
     st.set_page_config(page_title="OrthoTracker Pro", page_icon="🏥", layout="wide")
     st.title("🦴 OrthoTracker Pro Dashboard")
 
-    seed_defaults()  # ensure there is at least some data to start with
-
     menu = ["Dashboard", "Insights", "Projections", "Add Data"]
     choice = st.sidebar.selectbox("Menu", menu)
 
-    # Fetch dataframe (not cached over-adds because we commit then rerun)
-    df = get_all_reports()
-
     # ---------- Dashboard ----------
     if choice == "Dashboard":
         st.subheader("📊 Dashboard Overview")
-        if df.empty:
+        version = reports_version()
+        total_reports = report_count(version)
+        if total_reports == 0:
             st.info("No reports available yet.")
         else:
-            st.dataframe(df.sort_values("date", ascending=False).reset_index(drop=True))
+            st.dataframe(recent_reports(version))
+            if total_reports > DASHBOARD_TABLE_LIMIT:
+                st.caption(f"Showing the latest {DASHBOARD_TABLE_LIMIT:,} of {total_reports:,} reports; the CSV download has all of them.")
 
             # Cases per Representative
-            cases_by_rep = df.groupby("rep", as_index=False)["cases"].sum()
-            fig_cases = px.bar(
-                cases_by_rep,
-                x="rep", y="cases",
-                title="Total Cases by Representative",
-                color="cases",
-                color_continuous_scale="Viridis"
-            )
+            fig_cases = build_cases_fig(cases_by_rep(version))
             st.plotly_chart(fig_cases, use_container_width=True)
 
             # Income over time (monthly)
-            income_time = df.groupby(df["date"].dt.to_period("M"))["income"].sum().reset_index()
+            income_time = income_by_month(version)
             if not income_time.empty:
-                income_time["date"] = income_time["date"].dt.to_timestamp()
-                fig_income = px.line(
-                    income_time,
-                    x="date", y="income",
-                    title="Income Over Time",
-                    markers=True,
-                    line_shape="spline"
-                )
+                fig_income = build_income_fig(income_time, "Income Over Time")
                 st.plotly_chart(fig_income, use_container_width=True)
 
             # CSV export
-            csv = df.to_csv(index=False).encode("utf-8")
-            st.download_button("📥 Download CSV", data=csv, file_name="ortho_reports.csv", mime="text/csv")
+            # on_click="ignore": downloading shouldn't rerun the whole dashboard
+            st.download_button("📥 Download CSV", data=reports_csv(version), file_name="ortho_reports.csv", mime="text/csv", on_click="ignore")
 
     # ---------- Insights ----------
     elif choice == "Insights":
         st.subheader("🔍 Insights")
-        if df.empty:
+        version = reports_version()
+        top_reps = cases_by_rep(version).sort_values("cases", ascending=False).head(10)
+        if top_reps.empty:
             st.info("No data available for insights.")
         else:
-            top_reps = df.groupby("rep", as_index=False)["cases"].sum().sort_values("cases", ascending=False).head(10)
-            top_procs = df.groupby("procedure", as_index=False)["income"].sum().sort_values("income", ascending=False).head(10)
+            top_procs = income_by_procedure(version, 10)
 
             st.write("### Top Representatives by Cases")
-            fig_top_reps = px.pie(top_reps, names="rep", values="cases", title="Top Reps by Cases")
+            fig_top_reps = build_pie_fig(top_reps, "rep", "cases", "Top Reps by Cases")
             st.plotly_chart(fig_top_reps, use_container_width=True)
 
             st.write("### Top Procedures by Income")
-            fig_top_procs = px.pie(top_procs, names="procedure", values="income", title="Top Procedures by Income")
+            fig_top_procs = build_pie_fig(top_procs, "procedure", "income", "Top Procedures by Income")
             st.plotly_chart(fig_top_procs, use_container_width=True)
 
             # simple KPI
-            st.metric("Total Income (KSh)", f"{df['income'].sum():,.0f}")
-            st.metric("Total Cases", int(df['cases'].sum()))
+            total_cases, total_income = get_report_totals(version)
+            st.metric("Total Income (KSh)", f"{total_income:,.0f}")
+            st.metric("Total Cases", total_cases)
 
     # ---------- Projections ----------
     elif choice == "Projections":
         st.subheader("📈 Income Projections")
-        if df.empty:
+        version = reports_version()
+        monthly = income_by_month(version)
+        if monthly.empty:
             st.info("No data available for projections.")
         else:
-            monthly = df.groupby(df["date"].dt.to_period("M"))["income"].sum().reset_index()
-            monthly["date"] = monthly["date"].dt.to_timestamp()
-            fig_proj = px.line(monthly, x="date", y="income", title="Monthly Income", markers=True, line_shape="spline")
+            fig_proj = build_income_fig(monthly, "Monthly Income")
             st.plotly_chart(fig_proj, use_container_width=True)
 
             projected_annual = monthly["income"].mean() * 12
@@ -193,123 +621,7 @@ def main():
 
     # ---------- Add Data ----------
     elif choice == "Add Data":
-        st.subheader("➕ Add New Report / Entities")
-        db = get_session()
-        try:
-            reps = [r.name for r in db.query(Representative).order_by(Representative.name).all()]
-            procs = [p.name for p in db.query(Procedure).order_by(Procedure.name).all()]
-        finally:
-            db.close()
-
-        col1, col2 = st.columns(2)
-        with col1:
-            if reps:
-                rep_name = st.selectbox("Representative", reps)
-            else:
-                rep_name = None
-                st.warning("No representatives found. Add one below.")
-
-            new_rep = st.text_input("Or add new Representative (type a name and press +)", key="new_rep")
-            if st.button("➕ Add Representative"):
-                if new_rep.strip():
-                    db = get_session()
-                    try:
-                        if db.query(Representative).filter_by(name=new_rep.strip()).first():
-                            st.warning("Representative already exists.")
-                        else:
-                            db.add(Representative(name=new_rep.strip()))
-                            db.commit()
-                            st.success("Representative added.")
-                            st.experimental_rerun()
-                    except Exception as e:
-                        db.rollback()
-                        st.error("Failed to add representative.")
-                        st.error(str(e))
-                    finally:
-                        db.close()
-
-        with col2:
-            if procs:
-                proc_name = st.selectbox("Procedure", procs)
-            else:
-                proc_name = None
-                st.warning("No procedures found. Add one below.")
-
-            new_proc = st.text_input("Or add new Procedure (type a name and press +)", key="new_proc")
-            if st.button("➕ Add Procedure"):
-                if new_proc.strip():
-                    db = get_session()
-                    try:
-                        if db.query(Procedure).filter_by(name=new_proc.strip()).first():
-                            st.warning("Procedure already exists.")
-                        else:
-                            db.add(Procedure(name=new_proc.strip()))
-                            db.commit()
-                            st.success("Procedure added.")
-                            st.experimental_rerun()
-                    except Exception as e:
-                        db.rollback()
-                        st.error("Failed to add procedure.")
-                        st.error(str(e))
-                    finally:
-                        db.close()
-
-        st.markdown("---")
-        st.write("Add a report (choose existing rep/procedure or add new ones above).")
-        # fallback: if no existing reps/procs, require manual name
-        rep_name_final = rep_name if rep_name else st.text_input("Representative name (required if none above)")
-        proc_name_final = proc_name if proc_name else st.text_input("Procedure name (required if none above)")
-
-        cases = st.number_input("Cases Done", min_value=0, step=1, value=0)
-        income = st.number_input("Income Generated (KSh)", min_value=0.0, step=100.0, value=0.0)
-        report_date = st.date_input("Reported Date", value=datetime.utcnow().date())
-        uploaded_file = st.file_uploader("Attach file (optional)", type=["pdf", "png", "jpg", "jpeg"])
-
-        if st.button("Submit Report"):
-            if not rep_name_final or not proc_name_final:
-                st.error("Representative and Procedure are required.")
-            else:
-                db = get_session()
-                try:
-                    # get or create rep
-                    rep = db.query(Representative).filter_by(name=rep_name_final.strip()).first()
-                    if not rep:
-                        rep = Representative(name=rep_name_final.strip())
-                        db.add(rep)
-                        db.flush()  # assign id
-
-                    proc = db.query(Procedure).filter_by(name=proc_name_final.strip()).first()
-                    if not proc:
-                        proc = Procedure(name=proc_name_final.strip())
-                        db.add(proc)
-                        db.flush()
-
-                    dt = datetime.combine(report_date, datetime.utcnow().time())
-                    new_report = Report(rep=rep, procedure=proc, cases_done=int(cases), income_generated=float(income), reported_at=dt)
-                    db.add(new_report)
-                    db.commit()
-
-                    # handle attachment
-                    if uploaded_file is not None:
-                        # store file on disk (simple approach) - consider storing in object storage for production
-                        filename = uploaded_file.name
-                        save_path = f"uploads/{filename}"
-                        with open(save_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        att = Attachment(procedure_id=proc.id, filename=save_path)
-                        db.add(att)
-                        db.commit()
-
-                    st.success("✅ Report added successfully!")
-                    # clear cached reports and rerun to reflect new data
-                    _fetch_reports_serialized.clear()
-                    st.experimental_rerun()
-                except Exception as e:
-                    db.rollback()
-                    st.error("Failed to save report.")
-                    st.error(str(e))
-                finally:
-                    db.close()
+        add_data_view()
 
 if __name__ == "__main__":
     main()